@@ -1,36 +1,381 @@
-from fastapi import FastAPI, Query
+import asyncio
+import hashlib
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+from cachetools import TLRUCache
+import httpx
+from fastapi import Depends, FastAPI, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import orjson
 import os
-from typing import Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, FrozenSet, Optional, Tuple
 
 from strava_client import (
+    InvalidParameterError,
+    RateLimitError,
+    StravaClientError,
+    WeekRange,
+    get_http_client,
+    get_valid_token,
+    close_http_client,
+    resolve_week,
+    week_is_past,
     get_weekly_summary,
     get_weekly_details,
+    iter_weekly_details,
     get_weekly_analysis,
     get_weekly_history,
+    parse_types,
+    rate_limit_remaining,
+    token_hash,
 )
+from week_store import open_default_store, open_default_stream_store
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Un seul client httpx (pool keep-alive) pour tout le process : créé dès le démarrage,
+    # les appels Strava le récupèrent via get_http_client()
+    get_http_client()
+    # Caches disque ouverts ici (et non à l'import) : un second démarrage du process
+    # (tests, --reload) ne réutilise pas une connexion déjà fermée
+    # - semaines écoulées (/weekly-history), partagées entre redémarrages
+    app.state.week_store = open_default_store()
+    # - streams d'activités des semaines écoulées (/weekly-details, /weekly-analysis)
+    app.state.stream_store = open_default_stream_store()
+    yield
+    await close_http_client()
+    for store in (app.state.week_store, app.state.stream_store):
+        if store is not None:
+            store.close()
+
 
 app = FastAPI(
     title="CoachTriathlon API",
     version="1.4.0",
     description="Endpoints Strava (hebdo + cardio + récup) avec sélection de semaine (date/ISO) et historique multi-semaines.",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
+# Origines autorisées : CSV dans CORS_ORIGINS (ex: "https://chat.openai.com,https://coachtriathlon.app").
+# Non défini -> "*" (API publique en lecture seule, pas de cookies).
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "*").split(",") if o.strip()]
+
+
+class _UnexpectedErrorMiddleware:
+    """
+    Erreurs non prévues -> 500 JSON, construit ici (sous CORS/GZip) et non via
+    exception_handler(Exception) : Starlette le placerait hors de CORSMiddleware
+    (réponse sans Access-Control-Allow-Origin) puis relancerait l'exception.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as exc:
+            if started:
+                # réponse (streamée) déjà partie : rien à renvoyer, le serveur coupe la connexion
+                raise
+            request = Request(scope)
+            logger.exception("Erreur inattendue sur %s", request.url.path)
+            await _error_response(request, 500, str(exc))(scope, receive, send)
+
+
+# ajouté en premier = le plus interne : ses 500 traversent CORS et GZip
+app.add_middleware(_UnexpectedErrorMiddleware)
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=CORS_ORIGINS,
+    allow_methods=["GET"],
+    allow_headers=["Authorization", "Content-Type", "If-None-Match"],
+    expose_headers=["ETag", "Retry-After", "X-Strava-RateLimit-Remaining"],
+    max_age=86400,  # preflight mis en cache 24h côté navigateur
 )
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class _NdjsonAwareGZipMiddleware(GZipMiddleware):
+    """
+    GZip sauf pour les réponses NDJSON : le compresseur de Starlette ne vide pas son
+    tampon entre les chunks, le client recevrait tout d'un bloc à la fin du flux.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and _wants_ndjson(Headers(scope=scope)):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+# JSON très répétitif (clés, séries) : gzip niveau 5 = bon compromis ratio/CPU
+app.add_middleware(_NdjsonAwareGZipMiddleware, minimum_size=1024, compresslevel=5)
+
+logger = logging.getLogger("coachtriathlon")
+
+
+# -----------------------------
+# Erreurs -> réponses JSON uniformes {"error": "<endpoint>_failed", "detail": ...}
+# -----------------------------
+
+def _error_response(request: Request, status_code: int, detail: str) -> ORJSONResponse:
+    code = request.url.path.strip("/").replace("-", "_") or "request"
+    return ORJSONResponse({"error": f"{code}_failed", "detail": detail}, status_code=status_code)
+
+
+@app.exception_handler(InvalidParameterError)
+async def _invalid_parameter_handler(request: Request, exc: InvalidParameterError):
+    return _error_response(request, 400, str(exc))
+
+
+def _rate_limit_headers() -> Dict[str, str]:
+    short, daily = rate_limit_remaining()
+    return {"X-Strava-RateLimit-Remaining": f"{max(short, 0)},{max(daily, 0)}"}
+
+
+@app.exception_handler(RateLimitError)
+async def _rate_limit_handler(request: Request, exc: RateLimitError):
+    response = _error_response(request, 429, str(exc))
+    response.headers["Retry-After"] = str(exc.retry_after)
+    response.headers.update(_rate_limit_headers())
+    return response
+
+
+@app.exception_handler(StravaClientError)
+async def _strava_error_handler(request: Request, exc: StravaClientError):
+    return _error_response(request, 502, str(exc))
+
+
+@app.exception_handler(httpx.HTTPError)
+async def _strava_transport_error_handler(request: Request, exc: httpx.HTTPError):
+    return _error_response(request, 502, f"Strava injoignable: {exc!r}")
+
+
+# -----------------------------
+# Cache des réponses (in-process)
+# -----------------------------
+
+CACHE_TTL_S = 120            # semaine courante : les données peuvent encore bouger
+CACHE_TTL_PAST_S = 86400     # semaines écoulées : figées
+
+CACHE_CONTROL_CURRENT = "public, max-age=60, stale-while-revalidate=3600"
+CACHE_CONTROL_PAST = "public, max-age=86400, immutable"
+
+# valeur = (payload JSON sérialisé, ETag, ttl en secondes)
+_response_cache: TLRUCache = TLRUCache(maxsize=512, ttu=lambda _key, value, now: now + value[2])
+_response_cache_lock = asyncio.Lock()
+# calculs en cours : les requêtes identiques concurrentes attendent le même résultat
+_inflight: Dict[Tuple[Any, ...], "asyncio.Future[Tuple[bytes, str]]"] = {}
+
+
+def _cache_scope(query_token: Optional[str]) -> Optional[str]:
+    # Portée des données persistées (semaines, streams) : seuls les identifiants Strava configurés côté serveur
+    # sont stables. Un token explicite expire (~6 h) et n'identifie pas durablement son
+    # athlète : pas de persistance disque pour lui (cache mémoire uniquement).
+    return None if query_token else "server"
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or any(c.removeprefix("W/") == etag for c in candidates)
+
+
+async def _compute_payload(key: Tuple[Any, ...], past: bool, compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Tuple[bytes, str]:
+    """
+    Cache hit -> bytes mémorisés. Sinon un seul appel Strava par clé :
+    les requêtes arrivant pendant le calcul attendent le même Future.
+    """
+    async with _response_cache_lock:
+        hit = _response_cache.get(key)
+        if hit is not None:
+            return hit[0], hit[1]
+        inflight = _inflight.get(key)
+        if inflight is None:
+            fut = asyncio.get_running_loop().create_future()
+            _inflight[key] = fut
+    if inflight is not None:
+        return await asyncio.shield(inflight)
+
+    try:
+        # streams NumPy (analysis) sérialisés directement, sans repasser par des listes
+        body = orjson.dumps(await compute(), option=orjson.OPT_SERIALIZE_NUMPY)
+        etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        async with _response_cache_lock:
+            _response_cache[key] = (body, etag, CACHE_TTL_PAST_S if past else CACHE_TTL_S)
+        fut.set_result((body, etag))
+        return body, etag
+    except Exception as e:
+        fut.set_exception(e)
+        fut.exception()  # marque l'exception comme consommée s'il n'y a aucun autre appelant
+        raise
+    finally:
+        if not fut.done():
+            fut.cancel()
+        _inflight.pop(key, None)
+
+
+async def _cached_json(
+    request: Request,
+    key: Tuple[Any, ...],
+    past: bool,
+    compute: Callable[[], Awaitable[Dict[str, Any]]],
+    vary: Optional[str] = None,
+) -> Response:
+    """
+    Sert le payload depuis le cache (ou le calcule), avec ETag + Cache-Control.
+    Renvoie 304 si le client possède déjà la même version (If-None-Match).
+    """
+    body, etag = await _compute_payload(key, past, compute)
 
-def _get_token(query_token: Optional[str]) -> str:
-    if query_token:
-        return query_token
-    env_token = os.getenv("ACCESS_TOKEN")
-    if env_token:
-        return env_token
-    return ""
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL_PAST if past else CACHE_CONTROL_CURRENT, **_rate_limit_headers()}
+    if vary:
+        headers["Vary"] = vary
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+async def _details_json_chunks(first: Dict[str, Any], items: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """
+    JSON de /weekly-details émis activité par activité : seule l'activité en cours
+    est en mémoire. Le dernier élément (agrégats) ferme l'objet.
+    """
+    yield b'{"activities":['
+    prev = first
+    sep = b""
+    async for item in items:
+        yield sep + orjson.dumps(prev)
+        sep = b","
+        prev = item
+    yield b"]," + orjson.dumps(prev)[1:]
+
+
+async def _details_ndjson_chunks(first: Dict[str, Any], items: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """Variante NDJSON : une activité par ligne, la ligne finale porte les agrégats."""
+    yield orjson.dumps(first) + b"\n"
+    async for item in items:
+        yield orjson.dumps(item) + b"\n"
+
+
+def _accept_q(accept: str, media_type: str, explicit_only: bool = False) -> float:
+    """q-value accordée à media_type par un en-tête Accept (la plage la plus spécifique l'emporte)."""
+    main_type = media_type.split("/")[0]
+    best: Tuple[int, float] = (-1, 0.0)
+    for part in accept.split(","):
+        rng, *params = [p.strip() for p in part.split(";")]
+        rng = rng.lower()
+        if rng == media_type:
+            specificity = 2
+        elif not explicit_only and rng == f"{main_type}/*":
+            specificity = 1
+        elif not explicit_only and rng == "*/*":
+            specificity = 0
+        else:
+            continue
+        q = 1.0
+        for p in params:
+            name, _, value = p.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if specificity > best[0]:
+            best = (specificity, q)
+    return best[1]
+
+
+def _wants_ndjson(headers: Any) -> bool:
+    # NDJSON seulement s'il est demandé explicitement (q > 0) et pas moins que le JSON
+    accept = headers.get("accept", "")
+    q_ndjson = _accept_q(accept, NDJSON_MEDIA_TYPE, explicit_only=True)
+    return q_ndjson > 0 and q_ndjson >= _accept_q(accept, "application/json")
+
+
+# -----------------------------
+# Dépendances : paramètres communs résolus une fois par requête
+# -----------------------------
+
+@dataclass(frozen=True)
+class WeeklyOptions:
+    """Token résolu (+ empreintes pour les caches) et filtre de types, communs aux endpoints hebdo."""
+    access_token: str
+    token_hash: str
+    cache_scope: Optional[str]  # None : résultats non persistés sur disque
+    types: str
+    type_set: FrozenSet[str]  # clé de cache : "Run,Ride" et "Ride, Run" partagent la même entrée
+
+    @classmethod
+    async def from_query(
+        cls,
+        access_token: Optional[str] = Query(None, description="Token Strava (optionnel si refresh token configuré)"),
+        types: str = Query("all", description="Liste CSV ou 'all'."),
+    ) -> "WeeklyOptions":
+        # token serveur rafraîchi avant expiration plutôt qu'après un 401
+        token = await get_valid_token(access_token)
+        return cls(token, token_hash(token), _cache_scope(access_token), types, parse_types(types))
+
+
+@dataclass(frozen=True)
+class HeartRateOptions:
+    """Références cardio pour les zones (details/analysis)."""
+    hrmax: Optional[int]
+    hrrest: Optional[int]
+
+    @classmethod
+    def from_query(
+        cls,
+        hrmax: Optional[int] = Query(None, description="FC max (bpm) — sinon estimée"),
+        hrrest: Optional[int] = Query(None, description="FC repos (bpm) — utile pour Karvonen (défaut 60)"),
+    ) -> "HeartRateOptions":
+        return cls(hrmax, hrrest)
+
+    @classmethod
+    def for_details(
+        cls,
+        hrmax: Optional[int] = Query(None, description="FC max (bpm) pour zones (sinon estimée/fallback)"),
+        hrrest: Optional[int] = Query(None, description="FC repos (bpm) pour Karvonen si utilisé côté analysis"),
+    ) -> "HeartRateOptions":
+        # /weekly-details : zones en % FC max uniquement, descriptions propres à cet endpoint
+        return cls(hrmax, hrrest)
+
+
+def _week(
+    week_start: Optional[str] = Query(None, description="YYYY-MM-DD (lundi) pour cibler une semaine précise"),
+    iso_year: Optional[int] = Query(None, description="Année ISO (ex: 2025)"),
+    iso_week: Optional[int] = Query(None, description="Semaine ISO (1..53)"),
+) -> WeekRange:
+    return resolve_week(week_start, iso_year, iso_week)
+
+
+def _end_week(
+    end_week_start: Optional[str] = Query(None, description="YYYY-MM-DD (lundi) de la DERNIÈRE semaine de la fenêtre"),
+    iso_year: Optional[int] = Query(None, description="Année ISO de la DERNIÈRE semaine"),
+    iso_week: Optional[int] = Query(None, description="Numéro ISO de la DERNIÈRE semaine"),
+) -> WeekRange:
+    return resolve_week(end_week_start, iso_year, iso_week)
 
 
 @app.get("/healthz")
@@ -39,126 +384,136 @@ def healthz():
 
 
 @app.get("/weekly-stats")
-def weekly_stats(
-    access_token: Optional[str] = Query(None, description="Token Strava (optionnel si refresh token configuré)"),
-    types: str = Query("all", description="Liste CSV ou 'all'."),
-    week_start: Optional[str] = Query(None, description="YYYY-MM-DD (lundi) pour cibler une semaine précise"),
-    iso_year: Optional[int] = Query(None, description="Année ISO (ex: 2025)"),
-    iso_week: Optional[int] = Query(None, description="Semaine ISO (1..53)"),
+async def weekly_stats(
+    request: Request,
+    opts: WeeklyOptions = Depends(WeeklyOptions.from_query),
+    week: WeekRange = Depends(_week),
 ):
-    token = _get_token(access_token)
-    try:
-        data = get_weekly_summary(
-            access_token=token,
-            types=types,
-            week_start=week_start,
-            iso_year=iso_year,
-            iso_week=iso_week,
-        )
-        return JSONResponse(data)
-    except Exception as e:
-        return JSONResponse({"error": "weekly_stats_failed", "detail": str(e)}, status_code=500)
+    key = ("weekly-stats", opts.token_hash, opts.type_set, week.after_ts)
+    return await _cached_json(request, key, week_is_past(week), lambda: get_weekly_summary(
+        access_token=opts.access_token,
+        types=opts.types,
+        week=week,
+    ))
 
 
 @app.get("/weekly-details")
-def weekly_details(
-    access_token: Optional[str] = Query(None, description="Token Strava (optionnel si refresh token configuré)"),
-    types: str = Query("all", description="Liste CSV ou 'all'."),
+async def weekly_details(
+    request: Request,
+    opts: WeeklyOptions = Depends(WeeklyOptions.from_query),
     streams_mode: str = Query("none", description="'none' | 'summary' | 'full'"),
     max_points: int = Query(1500, ge=100, le=10000, description="Cap max points par série quand streams_mode=full"),
     compute_decoupling: bool = Query(False, description="Décorrélation HR (Run/Ride) si streams dispo"),
-    hrmax: Optional[int] = Query(None, description="FC max (bpm) pour zones (sinon estimée/fallback)"),
-    hrrest: Optional[int] = Query(None, description="FC repos (bpm) pour Karvonen si utilisé côté analysis"),
-    week_start: Optional[str] = Query(None, description="YYYY-MM-DD (lundi) pour cibler une semaine précise"),
-    iso_year: Optional[int] = Query(None, description="Année ISO (ex: 2025)"),
-    iso_week: Optional[int] = Query(None, description="Semaine ISO (1..53)"),
+    hr: HeartRateOptions = Depends(HeartRateOptions.for_details),
+    week: WeekRange = Depends(_week),
 ):
     """
     Détails hebdo. streams_mode:
       - none    : pas de séries
       - summary : pas de séries retournées (mais calculs zones/decoupling effectués si possible)
       - full    : séries HR/vitesse renvoyées (downsample max_points) + stats
+    Avec `Accept: application/x-ndjson` : une activité par ligne, agrégats en dernière ligne.
     """
-    token = _get_token(access_token)
-    try:
-        data = get_weekly_details(
-            access_token=token,
-            types=types,
-            streams_mode=streams_mode,
-            max_points=max_points,
-            compute_decoupling=compute_decoupling,
-            hrmax=hrmax,
-            hrrest=hrrest,
-            week_start=week_start,
-            iso_year=iso_year,
-            iso_week=iso_week,
+    past = week_is_past(week)
+    params = dict(
+        access_token=opts.access_token,
+        types=opts.types,
+        streams_mode=streams_mode,
+        max_points=max_points,
+        compute_decoupling=compute_decoupling,
+        hrmax=hr.hrmax,
+        hrrest=hr.hrrest,
+        week=week,
+        stream_store=request.app.state.stream_store if opts.cache_scope is not None else None,
+    )
+    ndjson = _wants_ndjson(request.headers)
+    if streams_mode == "full" or ndjson:
+        # séries complètes ou NDJSON : payload potentiellement lourd -> streamé, hors cache mémoire
+        items = iter_weekly_details(**params)
+        # premier élément attendu avant d'envoyer les en-têtes : les erreurs Strava restent des 4xx/5xx JSON
+        first = await items.__anext__()
+        return StreamingResponse(
+            _details_ndjson_chunks(first, items) if ndjson else _details_json_chunks(first, items),
+            media_type=NDJSON_MEDIA_TYPE if ndjson else "application/json",
+            headers={
+                "Cache-Control": CACHE_CONTROL_PAST if past else CACHE_CONTROL_CURRENT,
+                "Vary": "Accept",
+                **_rate_limit_headers(),
+            },
         )
-        return JSONResponse(data)
-    except Exception as e:
-        return JSONResponse({"error": "weekly_details_failed", "detail": str(e)}, status_code=500)
+
+    key = (
+        "weekly-details", opts.token_hash, opts.type_set, streams_mode, max_points,
+        compute_decoupling, hr.hrmax, hr.hrrest, week.after_ts,
+    )
+    return await _cached_json(request, key, past, lambda: get_weekly_details(**params), vary="Accept")
 
 
 @app.get("/weekly-analysis")
-def weekly_analysis(
-    access_token: Optional[str] = Query(None, description="Token Strava (optionnel si refresh token configuré)"),
-    types: str = Query("all", description="Liste CSV ou 'all'."),
+async def weekly_analysis(
+    request: Request,
+    opts: WeeklyOptions = Depends(WeeklyOptions.from_query),
     with_streams: bool = Query(True, description="Inclure les streams pour zones/decoupling (côté serveur)"),
     zone_model: str = Query("percent_max", description="'percent_max' ou 'karvonen'"),
-    hrmax: Optional[int] = Query(None, description="FC max (bpm) — sinon estimée"),
-    hrrest: Optional[int] = Query(None, description="FC repos (bpm) — utile pour Karvonen (défaut 60)"),
+    hr: HeartRateOptions = Depends(HeartRateOptions.from_query),
     compute_decoupling: bool = Query(True, description="Calcule l'HR decoupling si streams dispo"),
-    week_start: Optional[str] = Query(None, description="YYYY-MM-DD (lundi) pour cibler une semaine précise"),
-    iso_year: Optional[int] = Query(None, description="Année ISO (ex: 2025)"),
-    iso_week: Optional[int] = Query(None, description="Semaine ISO (1..53)"),
+    week: WeekRange = Depends(_week),
 ):
     """
     Analyse cardio hebdo (compacte) :
       - TRIMP total, temps en zones, monotony/strain, decoupling.
       - Semaine courante par défaut, ou semaine ciblée via date/ISO.
     """
-    token = _get_token(access_token)
-    try:
-        data = get_weekly_analysis(
-            access_token=token,
-            types=types,
-            with_streams=with_streams,
-            zone_model=zone_model,
-            hrmax=hrmax,
-            hrrest=hrrest,
-            compute_decoupling=compute_decoupling,
-            week_start=week_start,
-            iso_year=iso_year,
-            iso_week=iso_week,
-        )
-        return JSONResponse(data)
-    except Exception as e:
-        return JSONResponse({"error": "weekly_analysis_failed", "detail": str(e)}, status_code=500)
+    key = (
+        "weekly-analysis", opts.token_hash, opts.type_set, with_streams, zone_model,
+        hr.hrmax, hr.hrrest, compute_decoupling, week.after_ts,
+    )
+    return await _cached_json(request, key, week_is_past(week), lambda: get_weekly_analysis(
+        access_token=opts.access_token,
+        types=opts.types,
+        with_streams=with_streams,
+        zone_model=zone_model,
+        hrmax=hr.hrmax,
+        hrrest=hr.hrrest,
+        compute_decoupling=compute_decoupling,
+        week=week,
+        stream_store=request.app.state.stream_store if opts.cache_scope is not None else None,
+    ))
 
 
 @app.get("/weekly-history")
-def weekly_history(
-    access_token: Optional[str] = Query(None, description="Token Strava (optionnel si refresh token configuré)"),
-    types: str = Query("all", description="Liste CSV ou 'all'."),
+async def weekly_history(
+    request: Request,
+    opts: WeeklyOptions = Depends(WeeklyOptions.from_query),
     weeks: int = Query(8, ge=1, le=26, description="Nombre de semaines à remonter (par défaut 8, max 26)"),
-    end_week_start: Optional[str] = Query(None, description="YYYY-MM-DD (lundi) de la DERNIÈRE semaine de la fenêtre"),
-    iso_year: Optional[int] = Query(None, description="Année ISO de la DERNIÈRE semaine"),
-    iso_week: Optional[int] = Query(None, description="Numéro ISO de la DERNIÈRE semaine"),
+    end_week: WeekRange = Depends(_end_week),
 ):
     """
     Historique compact multi-semaines (sans streams) pour initialiser la mémoire du coach.
     Retourne une liste du plus ancien vers le plus récent.
     """
-    token = _get_token(access_token)
-    try:
-        data = get_weekly_history(
-            access_token=token,
-            types=types,
-            weeks=weeks,
-            end_week_start=end_week_start,
-            iso_year=iso_year,
-            iso_week=iso_week,
-        )
-        return JSONResponse(data)
-    except Exception as e:
-        return JSONResponse({"error": "weekly_history_failed", "detail": str(e)}, status_code=500)
+    # la fenêtre ne contient plus la semaine courante si sa dernière semaine est écoulée
+    key = ("weekly-history", opts.token_hash, opts.type_set, weeks, end_week.after_ts)
+    return await _cached_json(request, key, week_is_past(end_week), lambda: get_weekly_history(
+        access_token=opts.access_token,
+        types=opts.types,
+        weeks=weeks,
+        end_week=end_week,
+        week_store=request.app.state.week_store if opts.cache_scope is not None else None,
+        cache_scope=opts.cache_scope or "",
+    ))
+
+
+if __name__ == "__main__":
+    import uvicorn
 
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        loop="uvloop",
+        http="httptools",
+        # 1 worker par défaut : token Strava (refresh token rotatif), single-flight et budget
+        # de quota sont en mémoire du process ; N workers se les disputeraient
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+    )
@@ -1,12 +1,45 @@
 import os
+import sys
 import math
+import time
+import asyncio
+import hashlib
+import operator
+from bisect import bisect_right
+from collections import defaultdict
 from datetime import datetime, timedelta, timezone, date
-from typing import Dict, Any, List, Tuple, Optional
+from functools import lru_cache
+from typing import AsyncIterator, Dict, Any, FrozenSet, List, NamedTuple, Tuple, Optional
 
-import requests
+import httpx
+import numpy as np
+import orjson
+from cachetools import TLRUCache
+
+from week_store import StreamStore, WeekStore
 
 STRAVA_BASE = "https://www.strava.com/api/v3"
 
+
+class InvalidParameterError(ValueError):
+    """Paramètre de requête invalide (semaine, etc.) : erreur côté appelant."""
+
+
+class StravaClientError(Exception):
+    """Échec d'un appel à l'API Strava (statut HTTP non-2xx)."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class RateLimitError(StravaClientError):
+    """Quota Strava épuisé (refus local ou 429 Strava) : réessayer après retry_after secondes."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message, 429)
+        self.retry_after = retry_after
+
 # -----------------------------
 # Helpers Dates
 # -----------------------------
@@ -22,165 +55,534 @@ def _monday_of_iso_week(iso_year: int, iso_week: int) -> date:
     jan4_monday = jan4 - timedelta(days=(jan4.isoweekday() - 1))
     return jan4_monday + timedelta(weeks=iso_week - 1)
 
-def _week_range_from_params(
-    week_start: Optional[str],
-    iso_year: Optional[int],
-    iso_week: Optional[int],
-) -> Tuple[int, int, str]:
-    """
-    Retourne (after_ts, before_ts, label) en epoch seconds pour:
-      - la semaine de week_start (YYYY-MM-DD, attendu lundi)
-      - OU la semaine ISO (iso_year + iso_week)
-      - SINON la semaine courante (lundi->dimanche)
-    """
+class WeekRange(NamedTuple):
+    """Semaine lundi->dimanche résolue une seule fois : bornes epoch (UTC) + label."""
+    start: date
+    after_ts: int
+    before_ts: int
+    label: str
+
+@lru_cache(maxsize=1024)
+def _week_range_for_monday(start: date) -> WeekRange:
+    try:
+        end = start + timedelta(days=7) - timedelta(seconds=1)
+    except OverflowError:
+        raise InvalidParameterError("Semaine hors des dates supportées (années 1..9999).")
+    start_dt = datetime(start.year, start.month, start.day, 0, 0, 0, tzinfo=timezone.utc)
+    end_dt = datetime(end.year, end.month, end.day, 23, 59, 59, tzinfo=timezone.utc)
+    label = f"{start.isoformat()}..{end.isoformat()}"
+    return WeekRange(start, int(start_dt.timestamp()), int(end_dt.timestamp()), label)
+
+@lru_cache(maxsize=4096)
+def _monday_from_params(week_start: Optional[str], iso_year: Optional[int], iso_week: Optional[int]) -> date:
     if week_start:
         try:
             d = datetime.strptime(week_start, "%Y-%m-%d").date()
         except ValueError:
-            raise ValueError("week_start doit être au format YYYY-MM-DD (ex: 2025-08-11).")
+            raise InvalidParameterError("week_start doit être au format YYYY-MM-DD (ex: 2025-08-11).")
         # On normalise au lundi de la semaine de d (au cas où)
-        start = d - timedelta(days=(d.isoweekday() - 1))
-    elif iso_year and iso_week:
-        try:
-            start = _monday_of_iso_week(int(iso_year), int(iso_week))
-        except Exception:
-            raise ValueError("iso_year/iso_week invalides. Exemple: iso_year=2025&iso_week=33")
+        return d - timedelta(days=(d.isoweekday() - 1))
+    try:
+        return _monday_of_iso_week(int(iso_year), int(iso_week))
+    except Exception:
+        raise InvalidParameterError("iso_year/iso_week invalides. Exemple: iso_year=2025&iso_week=33")
+
+def resolve_week(
+    week_start: Optional[str] = None,
+    iso_year: Optional[int] = None,
+    iso_week: Optional[int] = None,
+) -> WeekRange:
+    """
+    Semaine ciblée par:
+      - week_start (YYYY-MM-DD, attendu lundi)
+      - OU la semaine ISO (iso_year + iso_week)
+      - SINON la semaine courante (lundi->dimanche)
+    """
+    if week_start or (iso_year and iso_week):
+        start = _monday_from_params(week_start, iso_year, iso_week)
     else:
-        # semaine courante (locale)
+        # semaine courante (locale) : jamais mémorisée telle quelle, seul son lundi sert de clé
         local_today = _utc_now().astimezone().date()
         start = local_today - timedelta(days=(local_today.isoweekday() - 1))
+    return _week_range_for_monday(start)
 
-    end = start + timedelta(days=7) - timedelta(seconds=1)
+def week_is_past(week: WeekRange) -> bool:
+    """True si la semaine est entièrement écoulée (ses données ne bougent plus)."""
+    return week.before_ts < int(_utc_now().timestamp())
 
-    start_dt = datetime(start.year, start.month, start.day, 0, 0, 0, tzinfo=timezone.utc)
-    end_dt = datetime(end.year, end.month, end.day, 23, 59, 59, tzinfo=timezone.utc)
+# -----------------------------
+# Client HTTP (partagé, keep-alive)
+# -----------------------------
 
-    label = f"{start.isoformat()}..{end.isoformat()}"
-    return int(start_dt.timestamp()), int(end_dt.timestamp()), label
+_http_client: Optional[httpx.AsyncClient] = None
+
+def get_http_client() -> httpx.AsyncClient:
+    """Client httpx partagé par tous les appels Strava (créé à la demande)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=30,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        )
+    return _http_client
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+def _raise_for_status(r: httpx.Response) -> None:
+    if r.is_success:
+        return
+    if r.status_code == 429:
+        wait = _rate_budget.block(time.time(), r.headers.get("retry-after"))
+        raise RateLimitError("Quota Strava dépassé", wait)
+    raise StravaClientError(f"Strava {r.status_code} sur {r.request.url.path}: {r.text[:200]}", r.status_code)
+
+# -----------------------------
+# Quota Strava (X-RateLimit-Limit / X-RateLimit-Usage : "15min,jour")
+# -----------------------------
+
+# attente max tolérée avant la fin de fenêtre ; au-delà -> RateLimitError (429) immédiat
+RATE_LIMIT_MAX_WAIT_S = float(os.getenv("STRAVA_RATE_LIMIT_MAX_WAIT_S", "2"))
+
+class _RateBudget:
+    """
+    Budget d'appels Strava du process, recalé sur les en-têtes de chaque réponse.
+    Les appels en cours (pending) sont décomptés d'avance : une rafale de streams
+    ne peut pas dépasser ce qu'il reste dans la fenêtre.
+    Fenêtres Strava : quarts d'heure pleins et journée UTC.
+    """
+
+    def __init__(self):
+        self.limit_short, self.limit_daily = 100, 1000
+        self.usage_short, self.usage_daily = 0, 0
+        self.short_reset_at, self.daily_reset_at = 0.0, 0.0
+        self.blocked_until = 0.0  # après un 429 : plus aucun appel avant cette date
+        self.pending = 0
+
+    def update(self, headers: httpx.Headers, now: float) -> None:
+        limit, usage = headers.get("x-ratelimit-limit"), headers.get("x-ratelimit-usage")
+        if not (limit and usage):
+            return
+        try:
+            self.limit_short, self.limit_daily = (int(x) for x in limit.split(",")[:2])
+            self.usage_short, self.usage_daily = (int(x) for x in usage.split(",")[:2])
+        except ValueError:
+            return
+        self.short_reset_at = (now // 900 + 1) * 900
+        self.daily_reset_at = (now // 86400 + 1) * 86400
+
+    def remaining(self, now: float) -> Tuple[int, int]:
+        short = self.limit_short - (self.usage_short if now < self.short_reset_at else 0)
+        daily = self.limit_daily - (self.usage_daily if now < self.daily_reset_at else 0)
+        if now < self.blocked_until:
+            short = min(short, 0)
+        return short - self.pending, daily - self.pending
+
+    def retry_after(self, now: float) -> int:
+        _, daily = self.remaining(now)
+        if daily <= 0:
+            reset_at = self.daily_reset_at
+        elif now < self.blocked_until:
+            reset_at = self.blocked_until
+        else:
+            reset_at = self.short_reset_at
+        return max(1, math.ceil(reset_at - now))
+
+    def block(self, now: float, retry_after: Optional[str]) -> int:
+        """
+        429 reçu (quota consommé ailleurs, en-têtes absents...) : blocage jusqu'au Retry-After
+        de Strava, sinon jusqu'à la fin du quart d'heure. Retourne l'attente en secondes.
+        """
+        try:
+            wait = float(retry_after)
+        except (TypeError, ValueError):
+            wait = (now // 900 + 1) * 900 - now
+        self.blocked_until = max(self.blocked_until, now + wait)
+        return self.retry_after(now)
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.time()
+            short, daily = self.remaining(now)
+            if short > 0 and daily > 0:
+                self.pending += 1
+                return
+            wait = self.retry_after(now)
+            if wait > RATE_LIMIT_MAX_WAIT_S:
+                raise RateLimitError(f"Quota Strava épuisé, réessayer dans {wait}s", wait)
+            await asyncio.sleep(wait)
+
+    def release(self) -> None:
+        self.pending -= 1
+
+_rate_budget = _RateBudget()
+
+def rate_limit_remaining() -> Tuple[int, int]:
+    """Appels Strava restants (fenêtre 15 min, journée) d'après les derniers en-têtes reçus."""
+    return _rate_budget.remaining(time.time())
 
 # -----------------------------
 # Helpers Auth
 # -----------------------------
 
-def _refresh_access_token_if_needed() -> Optional[str]:
+TOKEN_REFRESH_MARGIN_S = 60  # refresh anticipé avant expiration (évite un 401 + nouvel essai)
+
+# token serveur (STRAVA_REFRESH_TOKEN) et son expiration, gardés en mémoire du process ;
+# refresh_token : dernier refresh token renvoyé par Strava (il peut tourner), prioritaire sur l'env
+_token_cache: Dict[str, Any] = {"access_token": None, "expires_at": 0, "refresh_token": None}
+_token_lock = asyncio.Lock()
+
+def _cached_token_valid(now: float) -> bool:
+    return bool(_token_cache["access_token"]) and now < _token_cache["expires_at"] - TOKEN_REFRESH_MARGIN_S
+
+async def _refresh_access_token_if_needed(stale_token: Optional[str] = None) -> Optional[str]:
+    """
+    Refresh OAuth du token serveur. Un seul refresh à la fois : les appels concurrents
+    (401 simultanés, expiration) réutilisent le token obtenu par le premier.
+    """
     client_id = os.getenv("STRAVA_CLIENT_ID")
     client_secret = os.getenv("STRAVA_CLIENT_SECRET")
-    refresh_token = os.getenv("STRAVA_REFRESH_TOKEN")
-    if not (client_id and client_secret and refresh_token):
+    if not (client_id and client_secret and (_token_cache["refresh_token"] or os.getenv("STRAVA_REFRESH_TOKEN"))):
         return None
-    resp = requests.post(
-        "https://www.strava.com/oauth/token",
-        data={
-            "client_id": client_id,
-            "client_secret": client_secret,
-            "grant_type": "refresh_token",
-            "refresh_token": refresh_token,
-        },
-        timeout=30,
-    )
-    resp.raise_for_status()
-    data = resp.json()
-    token = data.get("access_token")
-    if token:
-        os.environ["ACCESS_TOKEN"] = token
-    return token
+    async with _token_lock:
+        if _cached_token_valid(time.time()) and _token_cache["access_token"] != stale_token:
+            return _token_cache["access_token"]
+        # lu sous le verrou : un refresh concurrent a pu faire tourner le refresh token
+        refresh_token = _token_cache["refresh_token"] or os.getenv("STRAVA_REFRESH_TOKEN")
+        resp = await get_http_client().post(
+            "https://www.strava.com/oauth/token",
+            data={
+                "client_id": client_id,
+                "client_secret": client_secret,
+                "grant_type": "refresh_token",
+                "refresh_token": refresh_token,
+            },
+            timeout=30,
+        )
+        _raise_for_status(resp)
+        data = orjson.loads(resp.content)
+        token = data.get("access_token")
+        if token:
+            _token_cache["access_token"] = token
+            _token_cache["expires_at"] = int(data.get("expires_at") or 0)
+            if data.get("refresh_token"):
+                _token_cache["refresh_token"] = data["refresh_token"]
+        return token
+
+async def get_valid_token(user_token: Optional[str] = None) -> str:
+    """
+    Token à utiliser pour une requête : celui fourni par l'appelant, sinon le token serveur
+    en mémoire (rafraîchi avant expiration), sinon ACCESS_TOKEN.
+    """
+    if user_token:
+        return user_token
+    if _cached_token_valid(time.time()):
+        return _token_cache["access_token"]
+    return await _refresh_access_token_if_needed() or os.getenv("ACCESS_TOKEN", "")
 
 def _auth_headers(access_token: str) -> Dict[str, str]:
     return {"Authorization": f"Bearer {access_token}"}
 
+# erreurs Strava transitoires (502/503 en pic de charge, connexion coupée) : quelques nouveaux essais espacés
+STRAVA_RETRY_STATUSES = frozenset({500, 502, 503, 504})
+STRAVA_RETRY_ERRORS = (httpx.ConnectError, httpx.RemoteProtocolError)
+STRAVA_RETRIES = 2
+STRAVA_RETRY_BACKOFF_S = 0.5  # puis x2
+
+async def _strava_get(access_token: str, path: str, params: Dict[str, Any]) -> Tuple[httpx.Response, str]:
+    """
+    GET Strava sous quota. Sur 401 : refresh du token puis un seul nouvel essai.
+    Sur 5xx / connexion perdue : jusqu'à STRAVA_RETRIES nouveaux essais (backoff exponentiel).
+    Retourne aussi le token effectivement utilisé (pour les appels suivants).
+    """
+    client = get_http_client()
+    refreshed = False
+    failures = 0
+    while True:
+        await _rate_budget.acquire()
+        r: Optional[httpx.Response] = None
+        try:
+            r = await client.get(f"{STRAVA_BASE}{path}", headers=_auth_headers(access_token), params=params, timeout=30)
+            _rate_budget.update(r.headers, time.time())
+        except STRAVA_RETRY_ERRORS:
+            if failures >= STRAVA_RETRIES:
+                raise
+        finally:
+            _rate_budget.release()
+        if (r is None or r.status_code in STRAVA_RETRY_STATUSES) and failures < STRAVA_RETRIES:
+            await asyncio.sleep(STRAVA_RETRY_BACKOFF_S * 2 ** failures)
+            failures += 1
+            continue
+        if r.status_code == 401 and not refreshed:
+            refreshed = True
+            new_token = await _refresh_access_token_if_needed(access_token)
+            if new_token:
+                access_token = new_token
+                continue
+        return r, access_token
+
 # -----------------------------
 # Streams helpers
 # -----------------------------
 
-def _downsample(seq: Optional[List[float]], max_points: int) -> Optional[List[float]]:
-    if not seq:
-        return seq
+def _stream_array(data: List[Any]) -> np.ndarray:
+    """
+    Série Strava -> tableau NumPy compact : entiers (FC, ...) en int16 si la plage le permet,
+    sinon float64 (None -> nan). ~10x moins de mémoire qu'une liste Python, en cache comme en calcul.
+    """
+    arr = np.asarray(data)
+    if arr.dtype.kind in "iu":
+        if arr.size and arr.min() >= np.iinfo(np.int16).min and arr.max() <= np.iinfo(np.int16).max:
+            return arr.astype(np.int16)
+        return arr
+    return np.asarray(data, dtype=np.float64)
+
+def _downsample(seq: np.ndarray, max_points: int) -> List[float]:
+    """Série sous-échantillonnée à pas constant, en liste prête pour la réponse JSON."""
     n = len(seq)
-    if n <= max_points:
-        return seq
-    step = max(1, n // max_points)
-    return seq[::step][:max_points]
+    if n > max_points:
+        step = max(1, n // max_points)
+        seq = seq[:step * max_points:step]  # une seule vue : max_points éléments au plus
+    return seq.tolist()
 
 # -----------------------------
 # Fetch Activities + Streams
 # -----------------------------
 
-DEFAULT_TYPES = {
+DEFAULT_TYPES: FrozenSet[str] = frozenset({
     "Ride", "Run", "Swim", "VirtualRide", "VirtualRun",
     "Hike", "Walk", "WeightTraining", "Workout",
     "Rowing", "Canoeing", "EBikeRide", "GravelRide",
     "Crossfit", "Yoga", "Elliptical",
     "AlpineSki", "NordicSki", "Snowboard", "InlineSkate",
-}
+})
 
-def _parse_types_param(types: str) -> set[str]:
+@lru_cache(maxsize=256)
+def parse_types(types: str) -> FrozenSet[str]:
+    """CSV 'types' -> ensemble figé de types Strava (mémorisé : mêmes valeurs à chaque requête)."""
     if types.lower().strip() == "all":
         return DEFAULT_TYPES
-    parts = [t.strip() for t in types.split(",") if t.strip()]
-    return set(parts) if parts else DEFAULT_TYPES
+    parts = frozenset(sys.intern(t.strip()) for t in types.split(",") if t.strip())
+    return parts or DEFAULT_TYPES
 
-def _fetch_activities_in_range(access_token: str, after_ts: int, before_ts: int, types: set[str]) -> List[Dict[str, Any]]:
-    activities: List[Dict[str, Any]] = []
-    page, per_page = 1, 100
-    while True:
-        r = requests.get(
-            f"{STRAVA_BASE}/athlete/activities",
-            headers=_auth_headers(access_token),
-            params={"after": after_ts, "before": before_ts, "page": page, "per_page": per_page},
-            timeout=30,
+# -----------------------------
+# Cache des appels Strava (in-process) : partagé entre endpoints
+# -----------------------------
+
+ACTIVITIES_CACHE_TTL_S = 120        # semaine en cours : une activité peut encore arriver
+ACTIVITIES_CACHE_TTL_PAST_S = 86400 # semaine écoulée
+STREAMS_CACHE_TTL_S = 86400         # streams d'une activité : immuables
+
+# valeurs = (données, ttl) ; les listes/dicts mis en cache ne doivent pas être modifiés
+_activities_cache: TLRUCache = TLRUCache(maxsize=256, ttu=lambda _key, value, now: now + value[1])
+_streams_cache: TLRUCache = TLRUCache(maxsize=256, ttu=lambda _key, value, now: now + value[1])
+# fetchs de listes d'activités en cours : les appels concurrents sur la même fenêtre attendent le même Future
+_activities_inflight: Dict[Tuple[str, int, int], "asyncio.Future[List[Dict[str, Any]]]"] = {}
+
+def token_hash(token: str) -> str:
+    """Empreinte courte du token : clé de cache sans stocker le token en clair."""
+    return hashlib.blake2b(token.encode(), digest_size=8).hexdigest()
+
+# seuls champs lus en aval (_activity_to_brief, filtres) : le reste (map, segments, ...) est libéré dès le parsing.
+# Les activités projetées ont toujours ces clés (None si absentes côté Strava).
+BRIEF_FIELDS: Tuple[str, ...] = (
+    "id", "name", "type", "start_date_local",
+    "distance", "moving_time", "elapsed_time", "total_elevation_gain",
+    "average_speed", "max_speed", "average_heartrate", "max_heartrate",
+    "suffer_score", "trainer", "commute",
+)
+ACTIVITY_FIELDS: Tuple[str, ...] = BRIEF_FIELDS + ("has_heartrate", "start_date")
+
+ACTIVITIES_PER_PAGE = 100
+ACTIVITIES_PAGE_PREFETCH = 3  # pages suivantes demandées en parallèle quand la page 1 est pleine
+
+async def _fetch_activities_in_range(access_token: str, after_ts: int, before_ts: int, types: FrozenSet[str]) -> List[Dict[str, Any]]:
+    # cache sur la liste brute : stats/details/analysis d'une même semaine partagent le fetch, quel que soit le filtre
+    key = (token_hash(access_token), after_ts, before_ts)
+    hit = _activities_cache.get(key)
+    raw = hit[0] if hit is not None else await _fetch_activities_shared(access_token, key)
+    return [a for a in raw if a.get("type") in types]
+
+async def _fetch_activities_shared(access_token: str, key: Tuple[str, int, int]) -> List[Dict[str, Any]]:
+    """
+    Fetch (puis mise en cache) d'une fenêtre : les appels concurrents sur la même fenêtre
+    (stats + details simultanés...) attendent le même Future au lieu de refaire la requête.
+    """
+    inflight = _activities_inflight.get(key)
+    if inflight is not None:
+        return await asyncio.shield(inflight)
+    fut = _activities_inflight[key] = asyncio.get_running_loop().create_future()
+    try:
+        raw = await _fetch_all_activities_in_range(access_token, key[1], key[2])
+        _cache_activities(key, raw)
+        fut.set_result(raw)
+        return raw
+    except Exception as e:
+        fut.set_exception(e)
+        fut.exception()  # marque l'exception comme consommée s'il n'y a aucun autre appelant
+        raise
+    finally:
+        if not fut.done():
+            fut.cancel()
+        _activities_inflight.pop(key, None)
+
+def _cache_activities(key: Tuple[str, int, int], raw: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    ttl = ACTIVITIES_CACHE_TTL_PAST_S if key[2] < time.time() else ACTIVITIES_CACHE_TTL_S
+    _activities_cache[key] = hit = (raw, ttl)
+    return hit
+
+def _start_ts(a: Dict[str, Any]) -> Optional[int]:
+    v = a.get("start_date")  # UTC, ex. "2025-08-11T06:30:00Z" : c'est lui que filtrent after/before
+    return int(datetime.fromisoformat(v.replace("Z", "+00:00")).timestamp()) if v else None
+
+async def _fetch_activities_windows(
+    access_token: str, windows: List[WeekRange], types: FrozenSet[str]
+) -> List[List[Dict[str, Any]]]:
+    """
+    Activités de plusieurs semaines : les semaines absentes du cache sont couvertes par
+    une seule requête (paginée) sur toute leur étendue, puis réparties par fenêtre
+    (et mises en cache comme si chacune avait été demandée seule).
+    """
+    th = token_hash(access_token)
+    keys = [(th, w.after_ts, w.before_ts) for w in windows]
+    raws: List[Optional[List[Dict[str, Any]]]] = [
+        hit[0] if (hit := _activities_cache.get(k)) is not None else None for k in keys
+    ]
+    missing = [i for i, raw in enumerate(raws) if raw is None]
+    if len(missing) == 1:
+        raws[missing[0]] = await _fetch_activities_shared(access_token, keys[missing[0]])
+    elif missing:
+        after_ts = min(keys[i][1] for i in missing)
+        before_ts = max(keys[i][2] for i in missing)
+        wide = await _fetch_all_activities_in_range(access_token, after_ts, before_ts)
+        starts = [_start_ts(a) for a in wide]
+        for i in missing:
+            lo, hi = keys[i][1], keys[i][2]
+            raws[i] = _cache_activities(keys[i], [a for a, ts in zip(wide, starts) if ts is not None and lo < ts < hi])[0]
+    return [[a for a in raw if a.get("type") in types] for raw in raws]
+
+async def _fetch_all_activities_in_range(access_token: str, after_ts: int, before_ts: int) -> List[Dict[str, Any]]:
+    per_page = ACTIVITIES_PER_PAGE
+
+    async def fetch_page(page: int) -> Tuple[List[Dict[str, Any]], str]:
+        r, token = await _strava_get(
+            access_token,
+            "/athlete/activities",
+            {"after": after_ts, "before": before_ts, "page": page, "per_page": per_page},
         )
-        if r.status_code == 401:
-            new_token = _refresh_access_token_if_needed()
-            if new_token:
-                access_token = new_token
-                r = requests.get(
-                    f"{STRAVA_BASE}/athlete/activities",
-                    headers=_auth_headers(access_token),
-                    params={"after": after_ts, "before": before_ts, "page": page, "per_page": per_page},
-                    timeout=30,
-                )
-        r.raise_for_status()
-        chunk = r.json()
-        if not chunk:
-            break
-        for a in chunk:
-            if a.get("type") in types:
-                activities.append(a)
-        if len(chunk) < per_page:
-            break
-        page += 1
+        _raise_for_status(r)
+        chunk = orjson.loads(r.content) if r.content else []
+        return [{k: a.get(k) for k in ACTIVITY_FIELDS} for a in chunk], token
+
+    # cas courant : une seule page (< 100 activités) -> un seul appel, pas de quota gaspillé
+    chunk, access_token = await fetch_page(1)
+    activities = list(chunk)
+    page = 2
+    while len(chunk) == per_page:
+        # fenêtre chargée : les pages suivantes partent ensemble, lues dans l'ordre jusqu'à la première incomplète
+        pages = await asyncio.gather(*[fetch_page(p) for p in range(page, page + ACTIVITIES_PAGE_PREFETCH)])
+        for chunk, access_token in pages:
+            activities.extend(chunk)
+            if len(chunk) < per_page:
+                break
+        page += ACTIVITIES_PAGE_PREFETCH
     return activities
 
-def _fetch_streams(access_token: str, activity_id: int, stream_keys: List[str]) -> Dict[str, List[float]]:
+# séries demandées par défaut (FC + vitesse) : une requête plus étroite peut être servie depuis celles-ci
+STREAM_KEYS: Tuple[str, ...] = ("heartrate", "velocity_smooth")
+
+def _subset(streams: Dict[str, np.ndarray], stream_keys: List[str]) -> Dict[str, np.ndarray]:
+    return {k: v for k, v in streams.items() if k in stream_keys}
+
+async def _fetch_streams(
+    access_token: str, activity_id: int, stream_keys: List[str], store: Optional[StreamStore] = None
+) -> Dict[str, np.ndarray]:
     if not stream_keys:
         return {}
-    r = requests.get(
-        f"{STRAVA_BASE}/activities/{activity_id}/streams",
-        headers=_auth_headers(access_token),
-        params={"keys": ",".join(stream_keys), "key_by_type": "true"},
-        timeout=30,
+    key = (token_hash(access_token), activity_id, tuple(stream_keys))
+    hit = _streams_cache.get(key)
+    if hit is None and set(stream_keys) < set(STREAM_KEYS):
+        full = _streams_cache.get((key[0], activity_id, STREAM_KEYS))
+        if full is not None:
+            return _subset(full[0], stream_keys)
+    if hit is None:
+        # accès SQLite (verrou + commit disque) hors de la boucle d'événements
+        streams = await asyncio.to_thread(_load_streams, store, activity_id, stream_keys) if store is not None else None
+        if streams is None:
+            streams = await _fetch_streams_uncached(access_token, activity_id, stream_keys)
+            if store is not None and streams:
+                await asyncio.to_thread(store.set, activity_id, stream_keys, streams)
+        _streams_cache[key] = hit = (streams, STREAMS_CACHE_TTL_S)
+    return hit[0]
+
+def _load_streams(store: StreamStore, activity_id: int, stream_keys: List[str]) -> Optional[Dict[str, np.ndarray]]:
+    """Streams lus sur disque, re-typés comme au parsing (int16/float64, null -> NaN)."""
+    data = store.get(activity_id, stream_keys)
+    if data is None and set(stream_keys) < set(STREAM_KEYS):
+        data = store.get(activity_id, STREAM_KEYS)
+        data = _subset(data, stream_keys) if data is not None else None
+    if data is None:
+        return None
+    return {k: _stream_array(v) for k, v in data.items() if v}
+
+async def _fetch_streams_uncached(access_token: str, activity_id: int, stream_keys: List[str]) -> Dict[str, np.ndarray]:
+    r, _ = await _strava_get(
+        access_token,
+        f"/activities/{activity_id}/streams",
+        {"keys": ",".join(stream_keys), "key_by_type": "true"},
     )
-    if r.status_code == 401:
-        new_token = _refresh_access_token_if_needed()
-        if new_token:
-            access_token = new_token
-            r = requests.get(
-                f"{STRAVA_BASE}/activities/{activity_id}/streams",
-                headers=_auth_headers(access_token),
-                params={"keys": ",".join(stream_keys), "key_by_type": "true"},
-                timeout=30,
-            )
     if r.status_code == 404:
         return {}
-    r.raise_for_status()
-    data = r.json() or {}
-    out: Dict[str, List[float]] = {}
+    _raise_for_status(r)
+    data = orjson.loads(r.content) if r.content else {}
+    out: Dict[str, np.ndarray] = {}
     for k in stream_keys:
         v = data.get(k)
-        if isinstance(v, dict) and isinstance(v.get("data"), list):
-            out[k] = v["data"]
+        # séries vides ignorées : en aval, "série présente" == "is not None"
+        if isinstance(v, dict) and isinstance(v.get("data"), list) and v["data"]:
+            out[k] = _stream_array(v["data"])
     return out
 
+STREAMS_CONCURRENCY = 5  # requêtes streams simultanées max (rate limit Strava), pour tout le process
+
+# sémaphore partagé par toutes les requêtes, créé dans la boucle qui l'utilise
+_streams_sem: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+
+def _streams_semaphore() -> asyncio.Semaphore:
+    global _streams_sem
+    loop = asyncio.get_running_loop()
+    if _streams_sem is None or _streams_sem[0] is not loop:
+        _streams_sem = (loop, asyncio.Semaphore(STREAMS_CONCURRENCY))
+    return _streams_sem[1]
+
+def _streams_tasks(
+    access_token: str, activity_ids: List[int], stream_keys: List[str], store: Optional[StreamStore] = None
+) -> List["asyncio.Task[Dict[str, np.ndarray]]"]:
+    """Lance les requêtes streams en parallèle (bornées par le sémaphore du process), une tâche par id."""
+    sem = _streams_semaphore()
+    async def one(activity_id: int) -> Dict[str, np.ndarray]:
+        async with sem:
+            return await _fetch_streams(access_token, activity_id, stream_keys, store)
+    return [asyncio.ensure_future(one(aid)) for aid in activity_ids]
+
+async def _fetch_streams_many(
+    access_token: str, activity_ids: List[int], stream_keys: List[str], store: Optional[StreamStore] = None
+) -> List[Dict[str, np.ndarray]]:
+    """Streams de plusieurs activités en parallèle, dans l'ordre des ids."""
+    tasks = _streams_tasks(access_token, activity_ids, stream_keys, store)
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        # première erreur (ou annulation) : les streams restants ne servent plus,
+        # ils libèrent leur place dans le sémaphore et le budget Strava
+        for t in tasks:
+            if not t.cancel() and not t.cancelled():
+                t.exception()  # tâche déjà terminée : son erreur éventuelle est consommée
+
 # -----------------------------
 # Mapping utiles
 # -----------------------------
@@ -189,30 +591,36 @@ def _safe(a: Dict[str, Any], key: str, default=None):
     v = a.get(key, default)
     return v if v is not None else default
 
+_activity_fields = operator.itemgetter(*BRIEF_FIELDS)
+
 def _activity_to_brief(a: Dict[str, Any]) -> Dict[str, Any]:
-    dist_km = float(_safe(a, "distance", 0.0)) / 1000.0
-    moving = int(_safe(a, "moving_time", 0))
-    elapsed = int(_safe(a, "elapsed_time", moving))
-    elev = float(_safe(a, "total_elevation_gain", 0.0))
-    type_ = _safe(a, "type", "Other")
-    avg_speed_kmh = float(a["average_speed"]) * 3.6 if _safe(a, "average_speed") is not None else None
-    max_speed_kmh = float(a["max_speed"]) * 3.6 if _safe(a, "max_speed") is not None else None
+    # activité projetée (BRIEF_FIELDS) : un seul itemgetter au lieu de ~15 _safe()
+    (
+        id_, name, type_, start_date_local,
+        distance, moving, elapsed, elev,
+        avg_speed, max_speed, avg_hr, max_hr,
+        suffer_score, trainer, commute,
+    ) = _activity_fields(a)
+    dist_km = float(distance if distance is not None else 0.0) / 1000.0
+    moving = int(moving if moving is not None else 0)
+    elapsed = int(elapsed if elapsed is not None else moving)
+    elev = float(elev if elev is not None else 0.0)
     return {
-        "id": _safe(a, "id"),
-        "name": _safe(a, "name"),
-        "type": type_,
-        "start_date_local": _safe(a, "start_date_local"),
+        "id": id_,
+        "name": name,
+        "type": type_ if type_ is not None else "Other",
+        "start_date_local": start_date_local,
         "distance_km": round(dist_km, 2),
         "moving_time_s": moving,
         "elapsed_time_s": elapsed,
         "elev_gain_m": round(elev, 1),
-        "avg_speed_kmh": round(avg_speed_kmh, 1) if avg_speed_kmh is not None else None,
-        "max_speed_kmh": round(max_speed_kmh, 1) if max_speed_kmh is not None else None,
-        "avg_heartrate": _safe(a, "average_heartrate"),
-        "max_heartrate": _safe(a, "max_heartrate"),
-        "suffer_score": _safe(a, "suffer_score"),
-        "trainer": bool(_safe(a, "trainer", False)),
-        "commute": bool(_safe(a, "commute", False)),
+        "avg_speed_kmh": round(float(avg_speed) * 3.6, 1) if avg_speed is not None else None,
+        "max_speed_kmh": round(float(max_speed) * 3.6, 1) if max_speed is not None else None,
+        "avg_heartrate": avg_hr,
+        "max_heartrate": max_hr,
+        "suffer_score": suffer_score,
+        "trainer": bool(trainer),
+        "commute": bool(commute),
     }
 
 # -----------------------------
@@ -220,62 +628,82 @@ def _activity_to_brief(a: Dict[str, Any]) -> Dict[str, Any]:
 # -----------------------------
 
 def _estimate_hrmax(activities: List[Dict[str, Any]]) -> Optional[int]:
-    mx: Optional[float] = None
-    for a in activities:
-        v = _safe(a, "max_heartrate")
-        if v is not None:
-            v = float(v)
-            mx = v if mx is None else max(mx, v)
-    if mx is None:
-        return None
-    return int(round(mx))
+    mx = max((float(v) for a in activities if (v := a.get("max_heartrate")) is not None), default=None)
+    return int(round(mx)) if mx is not None else None
+
+ZONE_NAMES = ("Z1", "Z2", "Z3", "Z4", "Z5")
+ZONE_PCTS = (0.60, 0.70, 0.80, 0.90)  # bornes basses Z2..Z5
+
+def _zones_from_bounds(bounds: List[int]):
+    """(nom, min, max) des 5 zones à partir des 4 bornes Z2..Z5, calculées une seule fois."""
+    lows = [0, *bounds]
+    highs = [*bounds, None]
+    return tuple(zip(ZONE_NAMES, lows, highs))
 
 def _zones_percent_max(hrmax: int):
-    return [
-        ("Z1", 0, math.floor(0.60 * hrmax)),
-        ("Z2", math.floor(0.60 * hrmax), math.floor(0.70 * hrmax)),
-        ("Z3", math.floor(0.70 * hrmax), math.floor(0.80 * hrmax)),
-        ("Z4", math.floor(0.80 * hrmax), math.floor(0.90 * hrmax)),
-        ("Z5", math.floor(0.90 * hrmax), None),
-    ]
+    return _zones_from_bounds([math.floor(p * hrmax) for p in ZONE_PCTS])
 
 def _zones_karvonen(hrmax: int, hrrest: int = 60):
-    def bpm(p: float) -> int:
-        return int(round(hrrest + p * (hrmax - hrrest)))
-    return [
-        ("Z1", 0, bpm(0.60)),
-        ("Z2", bpm(0.60), bpm(0.70)),
-        ("Z3", bpm(0.70), bpm(0.80)),
-        ("Z4", bpm(0.80), bpm(0.90)),
-        ("Z5", bpm(0.90), None),
-    ]
+    return _zones_from_bounds([int(round(hrrest + p * (hrmax - hrrest))) for p in ZONE_PCTS])
+
+@lru_cache(maxsize=64)
+def _zones_definition(zones: Tuple[Tuple[str, int, Optional[int]], ...]) -> Tuple[Dict[str, Any], ...]:
+    """Bloc "zones_definition" des réponses, construit une fois par jeu de zones (lecture seule)."""
+    return tuple({"zone": name, "min_bpm": lo, "max_bpm": hi} for name, lo, hi in zones)
 
 def _zone_index(bpm: int, zones) -> int:
-    for i, (_, lo, hi) in enumerate(zones):
-        if hi is None and bpm >= lo:
-            return i
-        if hi is not None and lo <= bpm < hi:
-            return i
-    return 0
-
-def _trimp_banister(duration_s: int, avg_hr: float, hrmax: int) -> float:
-    if duration_s <= 0 or not avg_hr or not hrmax:
-        return 0.0
-    hr_r = max(0.0, min(1.2, avg_hr / hrmax))
-    dur_min = duration_s / 60.0
-    return float(dur_min * hr_r * 0.64 * math.exp(1.92 * hr_r))
-
-def _time_in_zones_from_streams(hr_stream: List[int], zones, sampling_s: Optional[int] = None) -> Dict[str, int]:
-    if not hr_stream:
+    # bornes basses Z2..Z5 triées : même classement que _zone_lut, en O(log Z)
+    return bisect_right([z[1] for z in zones[1:]], bpm)
+
+def _trimp_banister(duration_s: List[int], avg_hr: List[float], hrmax: int) -> List[float]:
+    """TRIMP (Banister) de toutes les séances en une expression NumPy ; 0 sans durée ni FC moyenne."""
+    dur = np.asarray(duration_s, dtype=np.float64)
+    avg = np.asarray(avg_hr, dtype=np.float64)
+    if not hrmax or dur.size == 0:
+        return [0.0] * dur.size
+    hr_r = np.clip(avg / hrmax, 0.0, 1.2)
+    trimp = (dur / 60.0) * hr_r * 0.64 * np.exp(1.92 * hr_r)
+    return np.where((dur > 0) & (avg != 0), trimp, 0.0).tolist()
+
+@lru_cache(maxsize=64)
+def _zone_lut(bounds: Tuple[int, ...]) -> np.ndarray:
+    """
+    Table bpm -> index de zone pour des bornes basses Z2..Z5 données (fixes pour un
+    hrmax/hrrest/modèle) : le classement d'un stream devient un simple lut[hr].
+    """
+    size = max(256, bounds[-1] + 1 if bounds else 0)
+    lut = np.searchsorted(np.array(bounds, dtype=np.int64), np.arange(size), side="right").astype(np.uint8)
+    lut.setflags(write=False)
+    return lut
+
+def _hr_bpm(hr_stream: np.ndarray) -> np.ndarray:
+    """Série FC -> bpm entiers exploitables (échantillons manquants retirés)."""
+    hr = np.asarray(hr_stream)
+    if hr.dtype.kind not in "iu":
+        hr = np.asarray(hr_stream, dtype=np.float64)  # None -> nan
+        hr = hr[~np.isnan(hr)].astype(np.int64)       # tronque comme int(bpm)
+    return hr
+
+def _time_in_zones_from_streams(hr_stream: np.ndarray, zones, sampling_s: Optional[int] = None) -> Dict[str, int]:
+    if hr_stream is None or len(hr_stream) == 0:
         return {z[0]: 0 for z in zones}
+    return _time_in_zones_batch([hr_stream], zones, sampling_s)[0]
+
+def _time_in_zones_batch(hr_streams: List[np.ndarray], zones, sampling_s: Optional[int] = None) -> List[Dict[str, int]]:
+    """
+    Temps en zones de plusieurs séances en un seul passage : séries concaténées,
+    un seul lut[hr], puis bincount sur (séance, zone).
+    """
+    if not hr_streams:
+        return []
     step = sampling_s or 1
-    counts = [0] * len(zones)
-    for bpm in hr_stream:
-        if bpm is None:
-            continue
-        idx = _zone_index(int(bpm), zones)
-        counts[idx] += step
-    return {zones[i][0]: counts[i] for i in range(len(zones))}
+    nz = len(zones)
+    lut = _zone_lut(tuple(z[1] for z in zones[1:]))
+    bpm = [_hr_bpm(h) for h in hr_streams]
+    idx = lut[np.clip(np.concatenate(bpm), 0, len(lut) - 1)].astype(np.int64)
+    owner = np.repeat(np.arange(len(bpm)), [len(b) for b in bpm])
+    counts = (np.bincount(owner * nz + idx, minlength=len(bpm) * nz) * step).reshape(len(bpm), nz)
+    return [{zones[i][0]: int(row[i]) for i in range(nz)} for row in counts.tolist()]
 
 def _time_in_zones_from_avg(avg_hr: Optional[float], duration_s: int, zones) -> Dict[str, int]:
     out = {z[0]: 0 for z in zones}
@@ -285,37 +713,47 @@ def _time_in_zones_from_avg(avg_hr: Optional[float], duration_s: int, zones) ->
     out[zones[idx][0]] = duration_s
     return out
 
-def _hr_decoupling(hr: List[float], vel_mps: List[float]) -> Optional[float]:
+def _hr_decoupling(hr: np.ndarray, vel_mps: np.ndarray) -> Optional[float]:
     n = min(len(hr), len(vel_mps))
     if n < 60:
         return None
     mid = n // 2
-    def avg_ratio(vv, hh):
-        pairs = [(vv[i], hh[i]) for i in range(len(vv)) if hh[i] and hh[i] > 0]
-        if not pairs:
+    h = np.asarray(hr[:n], dtype=np.float64)
+    v = np.asarray(vel_mps[:n], dtype=np.float64)
+    valid = (h > 0) & ~np.isnan(v)
+    def avg_ratio(sl: slice) -> Optional[float]:
+        m = valid[sl]
+        if not m.any():
             return None
-        ratios = [p[0] / p[1] for p in pairs]
-        return sum(ratios) / len(ratios)
-    r1 = avg_ratio(vel_mps[:mid], hr[:mid])
-    r2 = avg_ratio(vel_mps[mid:], hr[mid:])
+        return float((v[sl][m] / h[sl][m]).mean())
+    r1 = avg_ratio(slice(0, mid))
+    r2 = avg_ratio(slice(mid, n))
     if r1 is None or r2 is None or r1 == 0:
         return None
     return float(round((r2 - r1) / r1 * 100.0, 2))
 
+def _monotony_strain(daily_trimp: List[float], trimp_total: float) -> Tuple[Optional[float], Optional[float]]:
+    """Monotony = moyenne / écart-type (n-1) des TRIMP journaliers ; Strain = TRIMP total x Monotony (Foster)."""
+    if not daily_trimp:
+        return None, None
+    arr = np.asarray(daily_trimp, dtype=np.float64)
+    std = float(arr.std(ddof=1)) if arr.size > 1 else 0.0
+    monotony = round(float(arr.mean()) / (std if std > 0 else 1.0), 2)
+    return monotony, round(trimp_total * monotony, 2)
+
 # -----------------------------
 # Public: weekly summary/details (semaine cible ou courante)
 # -----------------------------
 
-def get_weekly_summary(
+async def get_weekly_summary(
     access_token: str,
     types: str = "all",
-    week_start: Optional[str] = None,
-    iso_year: Optional[int] = None,
-    iso_week: Optional[int] = None,
+    week: Optional[WeekRange] = None,
 ) -> Dict[str, Any]:
-    type_set = _parse_types_param(types)
-    after_ts, before_ts, label = _week_range_from_params(week_start, iso_year, iso_week)
-    acts = _fetch_activities_in_range(access_token, after_ts, before_ts, type_set)
+    type_set = parse_types(types)
+    week = week or resolve_week()
+    after_ts, before_ts, label = week.after_ts, week.before_ts, week.label
+    acts = await _fetch_activities_in_range(access_token, after_ts, before_ts, type_set)
 
     total_km, total_time = 0.0, 0
     counts: Dict[str, int] = {}
@@ -333,7 +771,41 @@ def get_weekly_summary(
         "counts_by_type": counts,
     }
 
-def get_weekly_details(
+class _SportTotals:
+    """Cumuls par sport de /weekly-details (slots : pas de dict intermédiaire par sport)."""
+    __slots__ = ("count", "total_km", "elev_gain_m", "total_time_s", "avg_hr_sum", "avg_hr_n", "max_hr")
+
+    def __init__(self):
+        self.count = 0
+        self.total_km = 0.0
+        self.elev_gain_m = 0.0
+        self.total_time_s = 0
+        self.avg_hr_sum = 0.0
+        self.avg_hr_n = 0
+        self.max_hr: Optional[float] = None
+
+    def add(self, brief: Dict[str, Any]) -> None:
+        self.count += 1
+        self.total_km += brief["distance_km"]
+        self.elev_gain_m += brief["elev_gain_m"]
+        self.total_time_s += int(brief["moving_time_s"])
+        if brief.get("avg_heartrate") is not None:
+            self.avg_hr_sum += float(brief["avg_heartrate"])
+            self.avg_hr_n += 1
+        if brief.get("max_heartrate") is not None:
+            self.max_hr = max(self.max_hr or 0, float(brief["max_heartrate"]))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "total_km": round(self.total_km, 2),
+            "elev_gain_m": round(self.elev_gain_m, 1),
+            "max_hr": self.max_hr,
+            "total_time_h": round(self.total_time_s / 3600.0, 2),
+            "avg_hr": round(self.avg_hr_sum / self.avg_hr_n, 1) if self.avg_hr_n > 0 else None,
+        }
+
+async def iter_weekly_details(
     access_token: str,
     types: str = "all",
     streams_mode: str = "none",      # 'none' | 'summary' | 'full'
@@ -341,95 +813,127 @@ def get_weekly_details(
     compute_decoupling: bool = False,
     hrmax: Optional[int] = None,
     hrrest: Optional[int] = None,
-    week_start: Optional[str] = None,
-    iso_year: Optional[int] = None,
-    iso_week: Optional[int] = None,
-) -> Dict[str, Any]:
-    type_set = _parse_types_param(types)
-    after_ts, before_ts, label = _week_range_from_params(week_start, iso_year, iso_week)
-    acts = _fetch_activities_in_range(access_token, after_ts, before_ts, type_set)
+    week: Optional[WeekRange] = None,
+    stream_store: Optional[StreamStore] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Détails hebdo produits au fil de l'eau : chaque activité (dans l'ordre) dès que
+    ses streams sont arrivés, puis un dernier dict avec la partie agrégée (sans "activities").
+    Si `stream_store` est fourni, les streams d'une semaine écoulée y sont lus/écrits.
+    """
+    type_set = parse_types(types)
+    week = week or resolve_week()
+    after_ts, before_ts, label = week.after_ts, week.before_ts, week.label
+    acts = await _fetch_activities_in_range(access_token, after_ts, before_ts, type_set)
+
+    # briefs construits une fois : servent à l'estimation HRmax puis au détail
+    briefs = [_activity_to_brief(a) for a in acts]
 
     # zones pour temps en zones
-    est_hrmax = hrmax or _estimate_hrmax([_activity_to_brief(a) for a in acts]) or 190
+    est_hrmax = hrmax or _estimate_hrmax(briefs) or 190
     zones = _zones_percent_max(est_hrmax)
 
-    details: List[Dict[str, Any]] = []
-    by_sport: Dict[str, Dict[str, Any]] = {}
+    by_sport: Dict[str, _SportTotals] = {}
     sum_km, sum_time = 0.0, 0
 
     include_streams = streams_mode in ("summary", "full")
 
-    for a in acts:
-        brief = _activity_to_brief(a)
-        hr_stream = None
-        vel_stream = None
+    # Sans capteur cardio (has_heartrate=false), zones et decoupling ne peuvent pas utiliser les streams :
+    # seul le mode full (séries renvoyées, vitesse comprise) justifie encore l'appel.
+    wanted = [include_streams and (streams_mode == "full" or a.get("has_heartrate") is not False) for a in acts]
+    # la vitesse ne sert qu'aux séries renvoyées (full) et au decoupling : sinon, FC seule (réponse ~2x plus légère)
+    stream_keys = list(STREAM_KEYS) if streams_mode == "full" or compute_decoupling else ["heartrate"]
+
+    # streams récupérés en parallèle (I/O bound), consommés dans l'ordre des activités
+    fetched = iter(_streams_tasks(
+        access_token, [int(_safe(a, "id")) for a, w in zip(acts, wanted) if w], stream_keys,
+        stream_store if week_is_past(week) else None,
+    ))
+    tasks = [next(fetched) if w else None for w in wanted]
+    try:
+        for idx, brief in enumerate(briefs):
+            streams = await tasks[idx] if tasks[idx] is not None else None
+            hr_stream = None
+            vel_stream = None
 
-        if include_streams:
-            streams = _fetch_streams(access_token, int(brief["id"]), ["heartrate", "velocity_smooth"])
             if streams:
                 hr_stream = streams.get("heartrate")
                 vel_stream = streams.get("velocity_smooth")
                 if streams_mode == "full":
                     brief["streams"] = {
-                        "heartrate": _downsample(hr_stream, max_points) if hr_stream else None,
-                        "velocity_smooth_mps": _downsample(vel_stream, max_points) if vel_stream else None,
+                        "heartrate": _downsample(hr_stream, max_points) if hr_stream is not None else None,
+                        "velocity_smooth_mps": _downsample(vel_stream, max_points) if vel_stream is not None else None,
                     }
 
-        duration = int(brief.get("moving_time_s") or 0)
-        avg_hr = brief.get("avg_heartrate")
-        if hr_stream and len(hr_stream) >= max(10, duration // 6):
-            tiz = _time_in_zones_from_streams(hr_stream, zones, sampling_s=None)
-        else:
-            tiz = _time_in_zones_from_avg(avg_hr, duration, zones)
-        brief["time_in_zones_s"] = tiz
-
-        if compute_decoupling and hr_stream and vel_stream and (brief.get("type") in {"Ride", "VirtualRide", "Run", "TrailRun"}):
-            brief["hr_decoupling_percent"] = _hr_decoupling(hr_stream, vel_stream)
-
-        details.append(brief)
-
-        sp = brief["type"]
-        g = by_sport.setdefault(
-            sp,
-            {"count": 0, "total_km": 0.0, "elev_gain_m": 0.0, "total_time_s": 0, "avg_hr_sum": 0.0, "avg_hr_n": 0, "max_hr": None},
-        )
-        g["count"] += 1
-        g["total_km"] += brief["distance_km"]
-        g["elev_gain_m"] += brief["elev_gain_m"]
-        g["total_time_s"] += int(brief["moving_time_s"])
-        if brief.get("avg_heartrate") is not None:
-            g["avg_hr_sum"] += float(brief["avg_heartrate"])
-            g["avg_hr_n"] += 1
-        if brief.get("max_heartrate") is not None:
-            g["max_hr"] = max(g["max_hr"] or 0, float(brief["max_heartrate"]))
-
-        sum_km += brief["distance_km"]
-        sum_time += int(brief["moving_time_s"])
-
-    for sp, g in by_sport.items():
-        g["total_km"] = round(g["total_km"], 2)
-        g["elev_gain_m"] = round(g["elev_gain_m"], 1)
-        g["total_time_h"] = round(g["total_time_s"] / 3600.0, 2)
-        g["avg_hr"] = round(g["avg_hr_sum"] / g["avg_hr_n"], 1) if g["avg_hr_n"] > 0 else None
-        g["max_hr"] = g["max_hr"] if g["max_hr"] is not None else None
-        del g["avg_hr_sum"], g["avg_hr_n"], g["total_time_s"]
-
-    return {
+            duration = int(brief.get("moving_time_s") or 0)
+            avg_hr = brief.get("avg_heartrate")
+            if hr_stream is not None and len(hr_stream) >= max(10, duration // 6):
+                tiz = _time_in_zones_from_streams(hr_stream, zones, sampling_s=None)
+            else:
+                tiz = _time_in_zones_from_avg(avg_hr, duration, zones)
+            brief["time_in_zones_s"] = tiz
+
+            if compute_decoupling and hr_stream is not None and vel_stream is not None and (brief.get("type") in {"Ride", "VirtualRide", "Run", "TrailRun"}):
+                brief["hr_decoupling_percent"] = _hr_decoupling(hr_stream, vel_stream)
+
+            g = by_sport.get(brief["type"])
+            if g is None:
+                g = by_sport[brief["type"]] = _SportTotals()
+            g.add(brief)
+
+            sum_km += brief["distance_km"]
+            sum_time += int(brief["moving_time_s"])
+
+            yield brief
+    finally:
+        # consommateur parti (client déconnecté) ou erreur : plus besoin des streams restants
+        for t in tasks:
+            if t is not None and not t.cancel() and not t.cancelled():
+                t.exception()  # tâche déjà terminée : son erreur éventuelle est consommée
+
+    yield {
         "week_label": label,
         "summary": {"total_km": round(sum_km, 2), "total_time_h": round(sum_time / 3600.0, 2), "activities": len(acts)},
-        "by_sport": by_sport,
-        "activities": details,
-        "zones_definition": [{"zone": z[0], "min_bpm": z[1], "max_bpm": z[2]} for z in zones],
+        "by_sport": {sp: g.as_dict() for sp, g in by_sport.items()},
+        "zones_definition": list(_zones_definition(zones)),
         "hrmax_used": est_hrmax,
         "streams_mode": streams_mode,
         "max_points": max_points if streams_mode == "full" else None,
     }
 
+async def get_weekly_details(
+    access_token: str,
+    types: str = "all",
+    streams_mode: str = "none",      # 'none' | 'summary' | 'full'
+    max_points: int = 1500,
+    compute_decoupling: bool = False,
+    hrmax: Optional[int] = None,
+    hrrest: Optional[int] = None,
+    week: Optional[WeekRange] = None,
+    stream_store: Optional[StreamStore] = None,
+) -> Dict[str, Any]:
+    details: List[Dict[str, Any]] = [
+        item async for item in iter_weekly_details(
+            access_token, types, streams_mode, max_points, compute_decoupling, hrmax, hrrest, week, stream_store
+        )
+    ]
+    meta = details.pop()
+    return {
+        "week_label": meta["week_label"],
+        "summary": meta["summary"],
+        "by_sport": meta["by_sport"],
+        "activities": details,
+        "zones_definition": meta["zones_definition"],
+        "hrmax_used": meta["hrmax_used"],
+        "streams_mode": meta["streams_mode"],
+        "max_points": meta["max_points"],
+    }
+
 # -----------------------------
 # Public: weekly analysis (semaine cible ou courante)
 # -----------------------------
 
-def get_weekly_analysis(
+async def get_weekly_analysis(
     access_token: str,
     types: str = "all",
     with_streams: bool = True,
@@ -437,24 +941,31 @@ def get_weekly_analysis(
     hrmax: Optional[int] = None,
     hrrest: Optional[int] = None,
     compute_decoupling: bool = True,
-    week_start: Optional[str] = None,
-    iso_year: Optional[int] = None,
-    iso_week: Optional[int] = None,
+    week: Optional[WeekRange] = None,
+    stream_store: Optional[StreamStore] = None,   # streams des semaines écoulées, persistés sur disque
 ) -> Dict[str, Any]:
-    type_set = _parse_types_param(types)
-    after_ts, before_ts, label = _week_range_from_params(week_start, iso_year, iso_week)
-    acts_raw = _fetch_activities_in_range(access_token, after_ts, before_ts, type_set)
+    type_set = parse_types(types)
+    week = week or resolve_week()
+    after_ts, before_ts, label = week.after_ts, week.before_ts, week.label
+    acts_raw = await _fetch_activities_in_range(access_token, after_ts, before_ts, type_set)
+
+    # ni capteur cardio ni distance (renfo, yoga... sans ceinture) : ni FC ni vitesse à attendre des streams,
+    # l'appel (souvent un 404) est évité. Les séances sans FC mais avec distance gardent leur vitesse.
+    wanted = [with_streams and (a.get("has_heartrate") is not False or bool(a.get("distance"))) for a in acts_raw]
+    fetched = iter(await _fetch_streams_many(
+        access_token, [int(_safe(a, "id")) for a, w in zip(acts_raw, wanted) if w], list(STREAM_KEYS),
+        stream_store if week_is_past(week) else None,
+    ))
+    streams_list = [next(fetched) if w else None for w in wanted]
 
     activities: List[Dict[str, Any]] = []
-    for a in acts_raw:
+    for a, streams in zip(acts_raw, streams_list):
         brief = _activity_to_brief(a)
         hr_stream = vel_stream = None
-        if with_streams:
-            streams = _fetch_streams(access_token, int(brief["id"]), ["heartrate", "velocity_smooth"])
-            if streams:
-                hr_stream = streams.get("heartrate")
-                vel_stream = streams.get("velocity_smooth")
-        if hr_stream or vel_stream:
+        if streams:
+            hr_stream = streams.get("heartrate")
+            vel_stream = streams.get("velocity_smooth")
+        if hr_stream is not None or vel_stream is not None:
             brief["streams"] = {"heartrate": hr_stream, "velocity_smooth_mps": vel_stream}
         activities.append(brief)
 
@@ -462,15 +973,30 @@ def get_weekly_analysis(
     zones = _zones_karvonen(use_hrmax, hrrest or 60) if zone_model == "karvonen" else _zones_percent_max(use_hrmax)
 
     zone_labels = [z[0] for z in zones]
-    weekly_zone_seconds = {z: 0 for z in zone_labels}
+    # cumuls de temps en zones en vecteurs (ordre = zone_labels), convertis en dict en sortie
+    weekly_zone_totals = np.zeros(len(zone_labels), dtype=np.int64)
     weekly_trimp = 0.0
     total_time_s = 0
 
-    daily_trimp: Dict[str, float] = {}
-    trimp_by_type: Dict[str, float] = {}
+    # cumuls bruts, arrondis une seule fois en sortie (pas de dérive d'arrondi pour monotony)
+    daily_trimp: Dict[str, float] = defaultdict(float)
+    trimp_by_type: Dict[str, float] = defaultdict(float)
+    by_type: Dict[str, Dict[str, Any]] = {}
     analyzed_sessions: List[Dict[str, Any]] = []
 
-    for b in activities:
+    # temps en zones de toutes les séances à streams exploitables, calculé en un seul passage
+    def hr_for_zones(b: Dict[str, Any]) -> Optional[np.ndarray]:
+        hr = b["streams"].get("heartrate") if isinstance(b.get("streams"), dict) else None
+        return hr if hr is not None and len(hr) >= max(10, int(b.get("moving_time_s") or 0) // 6) else None
+    zone_hr = [hr_for_zones(b) for b in activities]
+    stream_tiz = iter(_time_in_zones_batch([hr for hr in zone_hr if hr is not None], zones, sampling_s=None))
+    trimps = _trimp_banister(
+        [int(b.get("moving_time_s") or 0) for b in activities],
+        [float(b.get("avg_heartrate") or 0.0) for b in activities],
+        use_hrmax,
+    )
+
+    for b, zhr, trimp in zip(activities, zone_hr, trimps):
         duration = int(b.get("moving_time_s") or 0)
         avg_hr = b.get("avg_heartrate")
         hr_stream = None
@@ -479,83 +1005,69 @@ def get_weekly_analysis(
             hr_stream = b["streams"].get("heartrate")
             vel_stream = b["streams"].get("velocity_smooth_mps")
 
-        if hr_stream and len(hr_stream) >= max(10, duration // 6):
-            tiz = _time_in_zones_from_streams(hr_stream, zones, sampling_s=None)
+        if zhr is not None:
+            tiz = next(stream_tiz)
         else:
             tiz = _time_in_zones_from_avg(avg_hr, duration, zones)
 
-        trimp = _trimp_banister(duration, float(avg_hr) if avg_hr else 0.0, use_hrmax)
-
         dec = None
-        if compute_decoupling and hr_stream and vel_stream and (b.get("type") in {"Ride", "VirtualRide", "Run", "TrailRun"}):
+        if compute_decoupling and hr_stream is not None and vel_stream is not None and (b.get("type") in {"Ride", "VirtualRide", "Run", "TrailRun"}):
             dec = _hr_decoupling(hr_stream, vel_stream)
 
-        for z in zone_labels:
-            weekly_zone_seconds[z] += int(tiz.get(z, 0))
+        tiz_vec = np.fromiter((tiz.get(z, 0) for z in zone_labels), dtype=np.int64, count=len(zone_labels))
+        weekly_zone_totals += tiz_vec
         weekly_trimp += trimp
         total_time_s += duration
 
         day_key = (b.get("start_date_local") or "")[:10] or "unknown"
-        daily_trimp[day_key] = round(daily_trimp.get(day_key, 0.0) + trimp, 2)
+        daily_trimp[day_key] += trimp
 
         t = b.get("type", "Other")
-        trimp_by_type[t] = round(trimp_by_type.get(t, 0.0) + trimp, 2)
+        trimp_by_type[t] += trimp
 
+        session_trimp = round(trimp, 1)
         analyzed_sessions.append({
             **b,
             "time_in_zones_s": tiz,
-            "trimp": round(trimp, 1),
+            "trimp": session_trimp,
             **({"hr_decoupling_percent": dec} if dec is not None else {}),
         })
 
+        # agrégats par sport dans la même passe (TRIMP arrondi par séance, comme affiché)
+        bt = by_type.setdefault(
+            t,
+            {"count": 0, "total_time_s": 0, "trimp": 0.0, "time_in_zones_s": np.zeros(len(zone_labels), dtype=np.int64)},
+        )
+        bt["count"] += 1
+        bt["total_time_s"] += duration
+        bt["trimp"] += session_trimp
+        bt["time_in_zones_s"] += tiz_vec
+
     weekly_summary = {
         "week_label": label,
         "sessions": len(analyzed_sessions),
         "total_time_h": round(total_time_s / 3600.0, 2),
         "trimp_total": round(weekly_trimp, 1),
-        "time_in_zones_s": weekly_zone_seconds,
+        "time_in_zones_s": dict(zip(zone_labels, weekly_zone_totals.tolist())),
         "zone_model": zone_model,
         "hrmax_used": use_hrmax,
         "hrrest_used": hrrest,
     }
 
-    monotony = None
-    strain = None
-    trimp_values = list(daily_trimp.values())
-    if trimp_values:
-        mean_daily = sum(trimp_values) / len(trimp_values)
-        if len(trimp_values) > 1:
-            var = sum((x - mean_daily) ** 2 for x in trimp_values) / (len(trimp_values) - 1)
-            std = math.sqrt(var)
-        else:
-            std = 0.0
-        monotony = round(mean_daily / (std if std > 0 else 1.0), 2)
-        strain = round(weekly_summary["trimp_total"] * monotony, 2)
+    monotony, strain = _monotony_strain(list(daily_trimp.values()), weekly_summary["trimp_total"])
 
     recovery = {
-        "daily_trimp": daily_trimp,
-        "trimp_by_type": trimp_by_type,
+        "daily_trimp": {k: round(v, 2) for k, v in daily_trimp.items()},
+        "trimp_by_type": {k: round(v, 2) for k, v in trimp_by_type.items()},
         "monotony": monotony,
         "strain": strain,
         "notes": "TRIMP (Banister). Monotony/Strain (Foster). Décorrélation HR par séance si streams disponibles.",
     }
 
-    by_type: Dict[str, Dict[str, Any]] = {}
-    for s in analyzed_sessions:
-        t = s.get("type", "Other")
-        bt = by_type.setdefault(
-            t,
-            {"count": 0, "total_time_s": 0, "trimp": 0.0, "time_in_zones_s": {z: 0 for z in zone_labels}},
-        )
-        bt["count"] += 1
-        bt["total_time_s"] += int(s.get("moving_time_s") or 0)
-        bt["trimp"] += float(s.get("trimp") or 0.0)
-        for z in zone_labels:
-            bt["time_in_zones_s"][z] += int(s["time_in_zones_s"].get(z, 0))
-
-    for t, bt in by_type.items():
+    for bt in by_type.values():
         bt["total_time_h"] = round(bt["total_time_s"] / 3600.0, 2)
         bt["trimp"] = round(bt["trimp"], 1)
+        bt["time_in_zones_s"] = dict(zip(zone_labels, bt["time_in_zones_s"].tolist()))
         del bt["total_time_s"]
 
     return {
@@ -563,82 +1075,102 @@ def get_weekly_analysis(
         "recovery": recovery,
         "by_type": by_type,
         "sessions": analyzed_sessions,
-        "zones_definition": [{"zone": z[0], "min_bpm": z[1], "max_bpm": z[2]} for z in zones],
+        "zones_definition": list(_zones_definition(zones)),
     }
 
 # -----------------------------
 # Public: weekly history (multi-semaines)
 # -----------------------------
 
-def get_weekly_history(
+def _history_week_item(label: str, acts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Résumé compact d'une semaine d'historique (sans streams)."""
+    total_km, total_time = 0.0, 0
+    counts: Dict[str, int] = {}
+    trimp_total = 0.0
+
+    briefs = [_activity_to_brief(a) for a in acts]
+    # HRmax hebdo pour TRIMP approx (sans streams)
+    hrmax_est = _estimate_hrmax(briefs) or 190
+
+    for brief in briefs:
+        total_km += brief["distance_km"]
+        total_time += int(brief["moving_time_s"])
+        t = brief.get("type", "Other")
+        counts[t] = counts.get(t, 0) + 1
+    # TRIMP simple via HR moy (si dispo), sommé dans l'ordre des séances
+    for trimp in _trimp_banister(
+        [int(b["moving_time_s"]) for b in briefs], [float(b.get("avg_heartrate") or 0.0) for b in briefs], hrmax_est
+    ):
+        trimp_total += trimp
+
+    return {
+        "week_label": label,
+        "sessions": len(acts),
+        "total_km": round(total_km, 2),
+        "total_time_h": round(total_time / 3600.0, 2),
+        "counts_by_type": counts,
+        "trimp_total": round(trimp_total, 1),
+    }
+
+async def get_weekly_history(
     access_token: str,
     types: str = "all",
     weeks: int = 8,
-    end_week_start: Optional[str] = None,   # si fourni, la dernière semaine = celle-ci
-    iso_year: Optional[int] = None,
-    iso_week: Optional[int] = None,
+    end_week: Optional[WeekRange] = None,   # dernière semaine de la fenêtre (défaut: semaine courante)
+    week_store: Optional[WeekStore] = None,
+    cache_scope: str = "",
 ) -> Dict[str, Any]:
     """
     Renvoie des résumés compacts par semaine (sans streams):
       - pour initialiser la mémoire du GPT
       - weeks=8 par défaut
+    Si `week_store` est fourni, les semaines écoulées y sont lues/écrites
+    (clé = cache_scope + types + lundi) : seule la semaine en cours est refetchée.
     """
-    type_set = _parse_types_param(types)
-
-    # Déterminer la dernière semaine (fin de fenêtre)
-    if end_week_start or (iso_year and iso_week):
-        after_ts_end, before_ts_end, label_end = _week_range_from_params(end_week_start, iso_year, iso_week)
-        # on part du lundi de cette semaine
-        end_week_monday = datetime.fromtimestamp(after_ts_end, tz=timezone.utc).date()
-    else:
-        local_today = _utc_now().astimezone().date()
-        end_week_monday = local_today - timedelta(days=(local_today.isoweekday() - 1))
+    type_set = parse_types(types)
+    types_key = ",".join(sorted(type_set))
+    now_ts = int(_utc_now().timestamp())
+
+    end_week_monday = (end_week or resolve_week()).start
+    # semaine i = end_week_monday - i semaines
+    try:
+        windows = [_week_range_for_monday(end_week_monday - timedelta(weeks=i)) for i in range(weeks)]
+    except OverflowError:
+        raise InvalidParameterError("Historique hors des dates supportées (années 1..9999).")
+
+    results: List[Optional[Dict[str, Any]]] = [None] * weeks
+    store_keys = [f"{cache_scope}|{types_key}|{w.start.isoformat()}" for w in windows]
+    # accès SQLite groupés et hors de la boucle d'événements (verrou + commit disque)
+    stored: Dict[str, Dict[str, Any]] = {}
+    if week_store is not None:
+        past_keys = [store_keys[i] for i, w in enumerate(windows) if w.before_ts < now_ts]
+        if past_keys:
+            stored = await asyncio.to_thread(week_store.get_many, past_keys)
+    missing: List[int] = []
+    for i in range(weeks):
+        cached = stored.get(store_keys[i])
+        if cached is not None:
+            results[i] = cached
+            continue
+        missing.append(i)
 
-    results: List[Dict[str, Any]] = []
+    # semaines manquantes : une seule requête Strava sur leur étendue, répartie par semaine
+    acts_list = await _fetch_activities_windows(access_token, [windows[i] for i in missing], type_set)
 
-    for i in range(weeks):
-        # semaine = end_week_monday - i semaines
-        start_i = end_week_monday - timedelta(weeks=i)
-        end_i = start_i + timedelta(days=7) - timedelta(seconds=1)
-
-        start_dt = datetime(start_i.year, start_i.month, start_i.day, 0, 0, 0, tzinfo=timezone.utc)
-        end_dt = datetime(end_i.year, end_i.month, end_i.day, 23, 59, 59, tzinfo=timezone.utc)
-        after_ts = int(start_dt.timestamp())
-        before_ts = int(end_dt.timestamp())
-        label = f"{start_i.isoformat()}..{end_i.isoformat()}"
-
-        acts = _fetch_activities_in_range(access_token, after_ts, before_ts, type_set)
-
-        total_km, total_time = 0.0, 0
-        counts: Dict[str, int] = {}
-        trimp_total = 0.0
-
-        # HRmax hebdo pour TRIMP approx (sans streams)
-        hrmax_est = _estimate_hrmax([_activity_to_brief(a) for a in acts]) or 190
-
-        for a in acts:
-            brief = _activity_to_brief(a)
-            total_km += brief["distance_km"]
-            total_time += int(brief["moving_time_s"])
-            t = brief.get("type", "Other")
-            counts[t] = counts.get(t, 0) + 1
-            # TRIMP simple via HR moy (si dispo)
-            trimp_total += _trimp_banister(int(brief["moving_time_s"]), float(brief.get("avg_heartrate") or 0.0), hrmax_est)
-
-        results.append({
-            "week_label": label,
-            "sessions": len(acts),
-            "total_km": round(total_km, 2),
-            "total_time_h": round(total_time / 3600.0, 2),
-            "counts_by_type": counts,
-            "trimp_total": round(trimp_total, 1),
-        })
+    to_store: Dict[str, Dict[str, Any]] = {}
+    for i, acts in zip(missing, acts_list):
+        item = _history_week_item(windows[i].label, acts)
+        if week_store is not None and windows[i].before_ts < now_ts:
+            to_store[store_keys[i]] = item
+        results[i] = item
+    if to_store:
+        await asyncio.to_thread(week_store.set_many, to_store)
 
     # tri du plus ancien au plus récent
     results = list(reversed(results))
     return {
         "weeks": weeks,
-        "types": list(type_set),
+        "types": sorted(type_set),
         "history": results,
     }
 
@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import orjson
+
+DEFAULT_CACHE_DIR = "/tmp/coachtri_cache"
+# âge max des lignes persistées : purgées à l'ouverture du store (taille disque bornée)
+WEEK_STORE_MAX_AGE_S = 180 * 86400
+STREAM_STORE_MAX_AGE_S = 60 * 86400
+
+
+class WeekStore:
+    """
+    Cache disque (SQLite) des résumés de semaines écoulées.
+    Ces semaines ne changent plus : elles survivent aux redémarrages du process
+    et évitent de re-solliciter Strava (quota journalier).
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS weeks (key TEXT PRIMARY KEY, payload BLOB NOT NULL, created_at INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS weeks_created_at ON weeks (created_at)")
+        self._db.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT payload FROM weeks WHERE key = ?", (key,)).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        self.set_many({key: value})
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        """Lecture groupée : {clé: résumé} pour les clés présentes."""
+        with self._lock:
+            rows = [self._db.execute("SELECT payload FROM weeks WHERE key = ?", (k,)).fetchone() for k in keys]
+        return {k: orjson.loads(row[0]) for k, row in zip(keys, rows) if row}
+
+    def set_many(self, values: Dict[str, Dict[str, Any]]) -> None:
+        """Écriture groupée : une seule transaction (un seul commit disque)."""
+        now = int(time.time())
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO weeks (key, payload, created_at) VALUES (?, ?, ?)",
+                [(k, orjson.dumps(v), now) for k, v in values.items()],
+            )
+            self._db.commit()
+
+    def prune(self, max_age_s: int) -> int:
+        """Supprime les lignes écrites il y a plus de max_age_s secondes ; renvoie leur nombre."""
+        with self._lock:
+            cur = self._db.execute("DELETE FROM weeks WHERE created_at < ?", (int(time.time()) - max_age_s,))
+            self._db.commit()
+        return cur.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class StreamStore:
+    """
+    Cache disque (SQLite) des streams d'activités (heartrate, vitesse...).
+    Les streams d'une activité passée ne bougent plus : clé = id d'activité + clés demandées.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS streams (key TEXT PRIMARY KEY, payload BLOB NOT NULL, created_at INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS streams_created_at ON streams (created_at)")
+        self._db.commit()
+
+    @staticmethod
+    def _key(activity_id: int, stream_keys: Sequence[str]) -> str:
+        return f"{activity_id}|{','.join(stream_keys)}"
+
+    def get(self, activity_id: int, stream_keys: Sequence[str]) -> Optional[Dict[str, List[Any]]]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT payload FROM streams WHERE key = ?", (self._key(activity_id, stream_keys),)
+            ).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def set(self, activity_id: int, stream_keys: Sequence[str], streams: Dict[str, Any]) -> None:
+        # séries NumPy sérialisées telles quelles (NaN -> null)
+        payload = orjson.dumps(streams, option=orjson.OPT_SERIALIZE_NUMPY)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO streams (key, payload, created_at) VALUES (?, ?, ?)",
+                (self._key(activity_id, stream_keys), payload, int(time.time())),
+            )
+            self._db.commit()
+
+    def prune(self, max_age_s: int) -> int:
+        """Supprime les lignes écrites il y a plus de max_age_s secondes ; renvoie leur nombre."""
+        with self._lock:
+            cur = self._db.execute("DELETE FROM streams WHERE created_at < ?", (int(time.time()) - max_age_s,))
+            self._db.commit()
+        return cur.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def _cache_dir() -> str:
+    return os.getenv("COACHTRI_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+
+def open_default_store() -> Optional[WeekStore]:
+    """Store du process (COACHTRI_CACHE_DIR), purgé des vieilles semaines, ou None si le disque n'est pas utilisable."""
+    try:
+        store = WeekStore(os.path.join(_cache_dir(), "weeks.sqlite3"))
+        store.prune(WEEK_STORE_MAX_AGE_S)
+        return store
+    except (OSError, sqlite3.Error):
+        return None
+
+
+def open_default_stream_store() -> Optional[StreamStore]:
+    """Store des streams (COACHTRI_STREAM_CACHE_DIR, sinon COACHTRI_CACHE_DIR), ou None si indisponible."""
+    cache_dir = os.getenv("COACHTRI_STREAM_CACHE_DIR") or _cache_dir()
+    try:
+        store = StreamStore(os.path.join(cache_dir, "streams.sqlite3"))
+        store.prune(STREAM_STORE_MAX_AGE_S)
+        return store
+    except (OSError, sqlite3.Error):
+        return None